@@ -1,4 +1,5 @@
 import math
+from operator import attrgetter
 
 __all__ = ['earcut', 'deviation', 'flatten']
 
@@ -275,7 +276,7 @@ def eliminateHoles(data, holeIndices, outerNode, dim):
 
         queue.append(getLeftmost(_list))
 
-    queue = sorted(queue, key=lambda i: i.x)
+    queue.sort(key=attrgetter('x'))
 
     # process holes from left to right
     for i in range(len(queue)):
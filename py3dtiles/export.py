@@ -8,11 +8,18 @@ import math
 import json
 import os
 import errno
+import multiprocessing
+import concurrent.futures
+from collections import defaultdict
 import numpy as np
 from py3dtiles import TriangleSoup, GlTF, B3dm, BatchTable
 
+IDENTITY = np.identity(4).flatten('F')
+
 
 class BoundingBox():
+    __slots__ = ('min', 'max')
+
     def __init__(self, minimum, maximum):
         self.min = [float(i) for i in minimum]
         self.max = [float(i) for i in maximum]
@@ -28,20 +35,29 @@ class BoundingBox():
         self.min = [min(i,j) for (i,j) in zip(self.min, box.min)]
         self.max = [max(i,j) for (i,j) in zip(self.max, box.max)]
 
+    @staticmethod
+    def from_points(points):
+        points = np.asarray(points)
+        return BoundingBox(points.min(axis=0), points.max(axis=0))
+
 
 class Feature():
-    def __init__(self, index, box):
+    __slots__ = ('index', 'box', 'center')
+
+    def __init__(self, index, box, center):
         self.index = index
         self.box = box
+        self.center = center
 
 
 class Node():
+    __slots__ = ('id', 'features', 'box', 'children')
     counter = 0
 
-    def __init__(self, features=[]):
+    def __init__(self, features=None):
         self.id = Node.counter
         Node.counter += 1
-        self.features = features
+        self.features = features if features is not None else []
         self.box = None
         self.children = []
 
@@ -49,14 +65,23 @@ class Node():
         self.children.append(node)
 
     def compute_bbox(self):
-        self.box = BoundingBox(
-            [float("inf"), float("inf"), float("inf")],
-            [-float("inf"), -float("inf"), -float("inf")])
-        for c in self.children:
-            c.compute_bbox()
-            self.box.add(c.box)
-        for g in self.features:
-            self.box.add(g.box)
+        # all_nodes lists parents before their children: walking it backwards
+        # computes every child box before its parent's, without recursion
+        for node in reversed(self.all_nodes()):
+            node.compute_own_bbox()
+
+    def compute_own_bbox(self):
+        # feature boxes are (min, max) rows of a single array: stack them as
+        # is and reduce them along with the children boxes in one go
+        corners = [[c.box.min, c.box.max] for c in self.children]
+        corners += [g.box for g in self.features]
+        if len(corners) == 0:
+            self.box = BoundingBox(
+                [float("inf"), float("inf"), float("inf")],
+                [-float("inf"), -float("inf"), -float("inf")])
+        else:
+            self.box = BoundingBox.from_points(
+                np.reshape(corners, (-1, 3)))
 
     def to_tileset(self, transform):
         self.compute_bbox()
@@ -69,12 +94,9 @@ class Node():
         return tiles
 
     def to_tileset_r(self, error):
-        (c1, c2) = (self.box.min, self.box.max)
-        center = [(c1[i] + c2[i]) / 2 for i in range(0, 3)]
-        xAxis = [(c2[0] - c1[0]) / 2, 0, 0]
-        yAxis = [0, (c2[1] - c1[1]) / 2, 0]
-        zAxis = [0, 0, (c2[2] - c1[2]) / 2]
-        box = [round(x, 3) for x in center + xAxis + yAxis + zAxis]
+        (hx, hy, hz) = [(j - i) / 2 for (i, j) in zip(self.box.min, self.box.max)]
+        box = [round(x, 3) for x in self.box.center()]
+        box += [round(hx, 3), 0, 0, 0, round(hy, 3), 0, 0, 0, round(hz, 3)]
         tile = {
             "boundingVolume": {
                 "box": box
@@ -91,9 +113,14 @@ class Node():
         return tile
 
     def all_nodes(self):
-        nodes = [self]
-        for c in self.children:
-            nodes.extend(c.all_nodes())
+        # depth-first, parents before their children, gathered in a single
+        # list rather than one list per subtree
+        nodes = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(reversed(node.children))
         return nodes
 
 
@@ -107,130 +134,192 @@ def tile_extent(extent, size, i, j):
     return BoundingBox(minExtent, maxExtent)
 
 
+def translation_transform(offset):
+    transform = np.identity(4)
+    transform[0:3, 3] = offset
+    return transform.flatten('F')
+
+
 # TODO: transform
-def arrays2tileset(positions, normals, bboxes, transform, ids=None):
+def arrays2tileset(positions, normals, bboxes, transform, ids=None,
+                   featuresPerTile=20, jobs=None):
+    # with less than one feature per tile, the quadtree subdivision would
+    # never end
+    if featuresPerTile < 1:
+        raise ValueError("featuresPerTile must be at least 1, got {}"
+                         .format(featuresPerTile))
     print("Creating tileset...")
     maxTileSize = 2000
-    featuresPerTile = 20
-    indices = [i for i in range(len(positions))]
 
     # glTF is Y-up, so to get the bounding boxes in the 3D tiles
     # coordinate system, we have to apply a Y-to-Z transform to the
-    # glTF bounding boxes
-    zUpBboxes = []
-    for bbox in bboxes:
-        tmp = m = bbox[0]
-        M = bbox[1]
-        m = [m[0], -m[2], m[1]]
-        M = [M[0], -tmp[2], M[1]]
-        zUpBboxes.append([m, M])
+    # glTF bounding boxes: (x, y, z) -> (x, -z, y), the min and max of the
+    # new y coordinate coming respectively from the max and min of z
+    corners = np.array(bboxes)
+    zUpBboxes = np.stack((corners[:, :, 0],
+                          -corners[:, ::-1, 2],
+                          corners[:, :, 1]), axis=2)
 
     # Compute extent
-    xMin = yMin = float('inf')
-    xMax = yMax = - float('inf')
-
-    for bbox in zUpBboxes:
-        xMin = min(xMin, bbox[0][0])
-        yMin = min(yMin, bbox[0][1])
-        xMax = max(xMax, bbox[1][0])
-        yMax = max(yMax, bbox[1][1])
+    xMin, yMin = zUpBboxes[:, 0, 0:2].min(axis=0)
+    xMax, yMax = zUpBboxes[:, 1, 0:2].max(axis=0)
     extent = BoundingBox([xMin, yMin], [xMax, yMax])
     extentX = xMax - xMin
     extentY = yMax - yMin
 
     # Create quadtree
-    tree = Node()
-    for i in range(0, int(math.ceil(extentX / maxTileSize))):
-        for j in range(0, int(math.ceil(extentY / maxTileSize))):
-            tile = tile_extent(extent, maxTileSize, i, j)
-
-            geoms = []
-            for idx, box in zip(indices, zUpBboxes):
-                bbox = BoundingBox(box[0], box[1])
-
-                if tile.inside(bbox.center()):
-                    geoms.append(Feature(idx, bbox))
+    # features are bucketed by grid cell in a single pass, instead of
+    # testing every feature against every cell
+    countX = int(math.ceil(extentX / maxTileSize))
+    countY = int(math.ceil(extentY / maxTileSize))
+    footprints = zUpBboxes[:, :, 0:2].astype(np.float64)
+    centers = footprints.mean(axis=1)
+    cellIndices = ((centers - [xMin, yMin]) // maxTileSize).astype(int)
+    cellIndices = np.minimum(cellIndices, [countX - 1, countY - 1])
+    cells = defaultdict(list)
+    for idx, (i, j) in enumerate(cellIndices.tolist()):
+        cells[(i, j)].append(
+            Feature(idx, zUpBboxes[idx], centers[idx].tolist()))
 
-            if len(geoms) == 0:
-                continue
-
-            if len(geoms) > featuresPerTile:
-                node = Node(geoms[0:featuresPerTile])
-                tree.add(node)
-                divide(tile, geoms[featuresPerTile:len(geoms)], i * 2,
-                       j * 2, maxTileSize / 2., featuresPerTile, node)
-            else:
-                node = Node(geoms)
-                tree.add(node)
+    tree = Node()
+    for (i, j) in sorted(cells):
+        tile = tile_extent(extent, maxTileSize, i, j)
+        geoms = cells[(i, j)]
+
+        if len(geoms) > featuresPerTile:
+            node = Node(geoms[0:featuresPerTile])
+            tree.add(node)
+            divide(tile, geoms[featuresPerTile:len(geoms)],
+                   maxTileSize / 2., featuresPerTile, node)
+        else:
+            node = Node(geoms)
+            tree.add(node)
 
     # Export b3dm & tileset
     tileset = tree.to_tileset(transform)
-    f = open("tileset.json".format(node.id), 'w')
-    f.write(json.dumps(tileset))
+    with open("tileset.json", 'w') as f:
+        f.write(json.dumps(tileset))
     print("Creating tiles...")
     nodes = tree.all_nodes()
-    identity = np.identity(4).flatten('F')
     try:
         os.makedirs("tiles")
     except OSError as e:
         if e.errno != errno.EEXIST:
             raise
-    for node in nodes:
-        if len(node.features) != 0:
-            binarrays = []
-            gids = []
-            for feature in node.features:
-                pos = feature.index
-                binarrays.append({
+    # tiles are independent from each other: build them in worker processes
+    # and hand the results over to writer threads
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor, \
+            concurrent.futures.ThreadPoolExecutor() as writer:
+        futures = {}
+        for node in nodes:
+            if len(node.features) != 0:
+                indices = [feature.index for feature in node.features]
+                binarrays = [{
                     'position': positions[pos],
                     'normal': normals[pos],
-                    'bbox': [[float(i) for i in j] for j in bboxes[pos]],
-                })
+                    'bbox': corners[pos].tolist(),
+                } for pos in indices]
+                gids = None
                 if ids is not None:
-                    gids.append(ids[pos])
-            gltf = GlTF.from_binary_arrays(binarrays, identity)
-            bt = None
-            if ids is not None:
-                bt = BatchTable()
-                bt.add_property_from_array("id", gids)
-            b3dm = B3dm.from_glTF(gltf, bt).to_array()
-            f = open("tiles/{0}.b3dm".format(node.id), 'wb')
-            f.write(b3dm)
-
-
-def divide(extent, geometries, xOffset, yOffset, tileSize,
-           featuresPerTile, parent):
-    for i in range(0, 2):
-        for j in range(0, 2):
-            tile = tile_extent(extent, tileSize, i, j)
-
-            geoms = []
-            for g in geometries:
-                if tile.inside(g.box.center()):
-                    geoms.append(g)
-            if len(geoms) == 0:
-                continue
-
-            if len(geoms) > featuresPerTile:
-                node = Node(geoms[0:featuresPerTile])
-                parent.add(node)
-                divide(tile, geoms[featuresPerTile:len(geoms)],
-                       (xOffset + i) * 2, (yOffset + j) * 2,
-                       tileSize / 2., featuresPerTile, node)
-            else:
-                node = Node(geoms)
-                parent.add(node)
-
-
-def wkbs2tileset(wkbs, ids, transform):
-    geoms = [TriangleSoup.from_wkb_multipolygon(wkb) for wkb in wkbs]
-    positions = [ts.getPositionArray() for ts in geoms]
-    normals = [ts.getNormalArray() for ts in geoms]
-    bboxes = [ts.getBbox() for ts in geoms]
-    arrays2tileset(positions, normals, bboxes, transform, ids)
-
-
-def from_db(db_name, table_name, column_name, id_column_name, user_name):
+                    gids = [ids[pos] for pos in indices]
+                future = executor.submit(arrays2b3dm, binarrays, gids,
+                                         IDENTITY)
+                futures[future] = node
+        # finished futures are dropped as soon as their tile is handed to
+        # a writer, and finished writes as soon as they are checked, so that
+        # tiles are not kept in memory once written
+        writes = set()
+        for future in concurrent.futures.as_completed(futures):
+            node = futures.pop(future)
+            writes.add(writer.submit(write_tile,
+                                     "tiles/{0}.b3dm".format(node.id),
+                                     future.result()))
+            done, writes = concurrent.futures.wait(writes, timeout=0)
+            for write in done:
+                write.result()
+        for write in concurrent.futures.as_completed(writes):
+            write.result()
+
+
+def write_tile(filename, array):
+    with open(filename, 'wb') as f:
+        f.write(array)
+
+
+def arrays2b3dm(binarrays, gids, transform):
+    gltf = GlTF.from_binary_arrays(binarrays, transform)
+    bt = None
+    if gids is not None:
+        bt = BatchTable()
+        bt.add_property_from_array("id", gids)
+    return B3dm.from_glTF(gltf, bt).to_array()
+
+
+def divide(extent, geometries, tileSize, featuresPerTile, parent):
+    # depth-first with an explicit stack instead of recursion. Quadrants are
+    # pushed in reverse order, so nodes are created (and numbered) in the
+    # same order as a recursive walk would
+    stack = []
+    push_quadrants(stack, extent, geometries, tileSize, parent)
+    while stack:
+        tile, geoms, tileSize, parent = stack.pop()
+        if len(geoms) > featuresPerTile:
+            node = Node(geoms[0:featuresPerTile])
+            parent.add(node)
+            push_quadrants(stack, tile, geoms[featuresPerTile:len(geoms)],
+                           tileSize / 2., node)
+        else:
+            node = Node(geoms)
+            parent.add(node)
+
+
+def push_quadrants(stack, extent, geometries, tileSize, parent):
+    # split the geometries between the four quadrants in a single pass
+    quadrants = [[[], []], [[], []]]
+    xSplit = extent.min[0] + tileSize
+    ySplit = extent.min[1] + tileSize
+    for g in geometries:
+        quadrants[g.center[0] >= xSplit][g.center[1] >= ySplit].append(g)
+
+    for i in reversed(range(0, 2)):
+        for j in reversed(range(0, 2)):
+            if len(quadrants[i][j]) != 0:
+                stack.append((tile_extent(extent, tileSize, i, j),
+                              quadrants[i][j], tileSize, parent))
+
+
+def wkb2arrays(wkb):
+    ts = TriangleSoup.from_wkb_multipolygon(wkb)
+    if len(ts.triangles[0]) == 0:
+        # empty geometry: nothing to draw, and no bounding box
+        return None
+    return ts.getPositionArray(), ts.getNormalArray(), ts.getBbox()
+
+
+def wkbs2tileset(wkbs, ids, transform, featuresPerTile=20, jobs=None):
+    # triangulation is CPU bound and each geometry is independent, so
+    # spread it over one process per core (or per job)
+    jobs = multiprocessing.cpu_count() if jobs is None else jobs
+    chunksize = max(1, len(wkbs) // (4 * jobs))
+    # psycopg2 returns bytea as memoryview, which cannot be pickled
+    wkbs = [bytes(wkb) for wkb in wkbs]
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        geoms = list(executor.map(wkb2arrays, wkbs, chunksize=chunksize))
+    # skip empty geometries, along with their ids
+    kept = [i for (i, g) in enumerate(geoms) if g is not None]
+    if len(kept) != len(geoms):
+        geoms = [geoms[i] for i in kept]
+        if ids is not None:
+            ids = [ids[i] for i in kept]
+    positions = [g[0] for g in geoms]
+    normals = [g[1] for g in geoms]
+    bboxes = [g[2] for g in geoms]
+    arrays2tileset(positions, normals, bboxes, transform, ids,
+                   featuresPerTile, jobs)
+
+
+def from_db(db_name, table_name, column_name, id_column_name, user_name,
+            featuresPerTile=20, jobs=None):
     user = getpass.getuser() if user_name is None else user_name
 
     try:
@@ -239,58 +328,67 @@ def from_db(db_name, table_name, column_name, id_column_name, user_name):
         pw = getpass.getpass("Postgres password for user {}\n".format(user))
         connection = psycopg2.connect(dbname=db_name, user=user, password=pw)
 
-    cur = connection.cursor()
+    # server-side cursor: rows are streamed by batches instead of having the
+    # whole table materialized client-side at once
+    cur = connection.cursor(name='py3dtiles_export')
+    cur.itersize = 10000
 
     print("Loading data from database...")
-    cur.execute("SELECT ST_3DExtent({0}) FROM {1}".format(column_name, table_name))
-    extent = cur.fetchall()[0][0]
-    extent = [m.split(" ") for m in extent[6:-1].split(",")]
-    offset = [(float(extent[1][0]) + float(extent[0][0])) / 2,
-              (float(extent[1][1]) + float(extent[0][1])) / 2,
-              (float(extent[1][2]) + float(extent[0][2])) / 2]
-
+    # the offset is computed by the server in the same round-trip as the
+    # geometries: every row carries it
     id_statement = ""
     if id_column_name is not None:
         id_statement = "," + id_column_name
-    cur.execute("SELECT ST_AsBinary(ST_RotateX(ST_Translate({0}, {1}, {2}, {3}), -pi() / 2)),"
-                "ST_Area(ST_Force2D({0})) AS weight{5} FROM {4} ORDER BY weight DESC"
-                .format(column_name, -offset[0], -offset[1], -offset[2],
-                        table_name, id_statement))
-    res = cur.fetchall()
-    wkbs = [t[0] for t in res]
-    ids = None
-    if id_column_name is not None:
-        ids = [t[2] for t in res]
-    transform = np.array([
-        [1, 0, 0, offset[0]],
-        [0, 1, 0, offset[1]],
-        [0, 0, 1, offset[2]],
-        [0, 0, 0, 1]], dtype=float)
-    transform = transform.flatten('F')
-
-    wkbs2tileset(wkbs, ids, transform)
-
-
-def from_directory(directory, offset):
-    # TODO: improvement -> order wkbs by geometry size, similarly to database mode
+    cur.execute("WITH extent AS (SELECT ST_3DExtent({0}) AS e FROM {1}),"
+                "tile_offset AS (SELECT (ST_XMin(e) + ST_XMax(e)) / 2 AS offset_x,"
+                "(ST_YMin(e) + ST_YMax(e)) / 2 AS offset_y,"
+                "(ST_ZMin(e) + ST_ZMax(e)) / 2 AS offset_z FROM extent) "
+                "SELECT ST_AsBinary(ST_RotateX(ST_Translate({0}, -offset_x, -offset_y, -offset_z), -pi() / 2)),"
+                "ST_Area(ST_Force2D({0})) AS weight,"
+                "offset_x, offset_y, offset_z{2} FROM {1}, tile_offset ORDER BY weight DESC"
+                .format(column_name, table_name, id_statement))
+    offset = None
+    wkbs = []
+    ids = None if id_column_name is None else []
+    for t in cur:
+        if offset is None:
+            offset = list(t[2:5])
+        wkbs.append(t[0])
+        if ids is not None:
+            ids.append(t[5])
+    cur.close()
+    wkbs2tileset(wkbs, ids, translation_transform(offset), featuresPerTile,
+                 jobs)
+
+
+def from_directory(directory, offset, featuresPerTile=20, jobs=None):
     offset = (0,0,0) if offset is None else offset
     # open all wkbs from directory
-    files = os.listdir(directory)
     files = [os.path.join(directory, f) for f in os.listdir(directory)]
     files = [f for f in files if os.path.isfile(f) and os.path.splitext(f)[1] == '.wkb']
-    wkbs = []
-    for f in files:
-        of = open(f, 'rb')
-        wkbs.append(of.read())
-        of.close()
+    # largest geometries first, similarly to database mode, so that they end
+    # up in the upper tiles. The file size is used as the geometry size: it
+    # is known without parsing the wkbs
+    files.sort(key=os.path.getsize, reverse=True)
+    # reading files releases the GIL: read them from several threads
+    with concurrent.futures.ThreadPoolExecutor() as reader:
+        wkbs = list(reader.map(read_wkb, files))
 
-    transform = np.array([
-        [1, 0, 0, offset[0]],
-        [0, 1, 0, offset[1]],
-        [0, 0, 1, offset[2]],
-        [0, 0, 0, 1]], dtype=float)
-    transform = transform.flatten('F')
-    wkbs2tileset(wkbs, None, transform)
+    wkbs2tileset(wkbs, None, translation_transform(offset),
+                 featuresPerTile, jobs)
+
+
+def read_wkb(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def strictly_positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            '{} is not a strictly positive integer'.format(value))
+    return number
 
 
 def init_parser(subparser, str2bool):
@@ -319,6 +417,14 @@ def init_parser(subparser, str2bool):
     u_help = 'database user name'
     parser.add_argument('-u', metavar='USER', type=str, help=u_help)
 
+    f_help = 'maximum number of features in a tile'
+    parser.add_argument('--features_per_tile', type=strictly_positive_int,
+                        default=20, help=f_help)
+
+    j_help = 'number of parallel jobs to start'
+    parser.add_argument('--jobs', type=strictly_positive_int,
+                        default=multiprocessing.cpu_count(), help=j_help)
+
 
 def main(args):
     if args.D is not None:
@@ -326,8 +432,9 @@ def main(args):
             print('Error: please define a table (-t) and column (-c)')
             exit()
 
-        from_db(args.D, args.t, args.c, args.i, args.u)
+        from_db(args.D, args.t, args.c, args.i, args.u,
+                args.features_per_tile, args.jobs)
     elif args.d is not None:
-        from_directory(args.d, args.o)
+        from_directory(args.d, args.o, args.features_per_tile, args.jobs)
     else:
         raise NameError('Error: database or directory must be set')
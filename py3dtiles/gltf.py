@@ -16,8 +16,7 @@ class GlTF(object):
         # body must be 4-byte aligned
         scene += ' '*((4 - len(scene) % 4) % 4)
 
-        padding = np.array([0 for i in range(0, (4 - len(self.body) % 4) % 4)],
-                           dtype=np.uint8)
+        padding = np.zeros((4 - len(self.body) % 4) % 4, dtype=np.uint8)
 
         length = 28 + len(self.body) + len(scene) + len(padding)
         binaryHeader = np.array([0x46546C67,  # "glTF" magic
@@ -120,16 +119,9 @@ class GlTF(object):
             binIds = [b''.join(binIds)]
             nVertices = [sum(nVertices)]
             batchLength = len(arrays)
-            [minx, miny, minz] = bb[0][0]
-            [maxx, maxy, maxz] = bb[0][1]
-            for box in bb[1:]:
-                minx = min(minx, box[0][0])
-                miny = min(miny, box[0][1])
-                minz = min(minz, box[0][2])
-                maxx = max(maxx, box[1][0])
-                maxy = max(maxy, box[1][1])
-                maxz = max(maxz, box[1][2])
-            bb = [[[minx, miny, minz], [maxx, maxy, maxz]]]
+            corners = np.array(bb)
+            bb = [[corners[:, 0].min(axis=0).tolist(),
+                   corners[:, 1].max(axis=0).tolist()]]
 
         glTF.header = compute_header(binVertices, nVertices, bb, transform,
                                      textured, batched, batchLength, uri,
@@ -141,11 +133,15 @@ class GlTF(object):
 
 
 def compute_binary(binVertices, binNormals, binIds, binUvs):
-    bv = b''.join(binVertices)
-    bn = b''.join(binNormals)
-    bid = b''.join(binIds)
-    buv = b''.join(binUvs)
-    return bv + bn + buv + bid
+    # every chunk is copied once, at its final offset in the buffer
+    chunks = [memoryview(c).cast('B')
+              for c in binVertices + binNormals + binUvs + binIds]
+    binary = bytearray(sum(c.nbytes for c in chunks))
+    offset = 0
+    for c in chunks:
+        binary[offset:offset + c.nbytes] = c
+        offset += c.nbytes
+    return binary
 
 
 def compute_header(binVertices, nVertices, bb, transform,
@@ -155,12 +151,15 @@ def compute_header(binVertices, nVertices, bb, transform,
     sizeVce = []
     for i in range(0, meshNb):
         sizeVce.append(len(binVertices[i]))
+    # total size of the vertices, computed once and reused by every buffer
+    # view below
+    sizeVertices = sum(sizeVce)
 
-    byteLength = 2 * sum(sizeVce)
+    byteLength = 2 * sizeVertices
     if textured:
-        byteLength += int(round(2 * sum(sizeVce) / 3))
+        byteLength += int(round(2 * sizeVertices / 3))
     if batched:
-        byteLength += int(round(sum(sizeVce) / 3))
+        byteLength += int(round(sizeVertices / 3))
     buffers = [{
         'byteLength': byteLength
     }]
@@ -172,39 +171,42 @@ def compute_header(binVertices, nVertices, bb, transform,
     # vertices
     bufferViews.append({
         'buffer': 0,
-        'byteLength': sum(sizeVce),
+        'byteLength': sizeVertices,
         'byteOffset': 0,
         'target': 34962
     })
     bufferViews.append({
         'buffer': 0,
-        'byteLength': sum(sizeVce),
-        'byteOffset': sum(sizeVce),
+        'byteLength': sizeVertices,
+        'byteOffset': sizeVertices,
         'target': 34962
     })
     if textured:
         bufferViews.append({
             'buffer': 0,
-            'byteLength': int(round(2 * sum(sizeVce) / 3)),
-            'byteOffset': 2 * sum(sizeVce),
+            'byteLength': int(round(2 * sizeVertices / 3)),
+            'byteOffset': 2 * sizeVertices,
             'target': 34962
         })
     if batched:
         bufferViews.append({
             'buffer': 0,
-            'byteLength': int(round(sum(sizeVce) / 3)),
-            'byteOffset': int(round(8 / 3 * sum(sizeVce))) if textured
-            else 2 * sum(sizeVce),
+            'byteLength': int(round(sizeVertices / 3)),
+            'byteOffset': int(round(8 / 3 * sizeVertices)) if textured
+            else 2 * sizeVertices,
             'target': 34962
         })
 
     # Accessor
     accessors = []
+    # offset of each mesh in the vertex and normal buffer views, accumulated
+    # instead of summing the sizes of all the previous meshes every time
+    meshOffset = 0
     for i in range(0, meshNb):
         # vertices
         accessors.append({
             'bufferView': 0,
-            'byteOffset': sum(sizeVce[0:i]),
+            'byteOffset': meshOffset,
             'componentType': 5126,
             'count': nVertices[i],
             'max': [bb[i][0][1], bb[i][0][2], bb[i][0][0]],
@@ -214,7 +216,7 @@ def compute_header(binVertices, nVertices, bb, transform,
         # normals
         accessors.append({
             'bufferView': 1,
-            'byteOffset': sum(sizeVce[0:i]),
+            'byteOffset': meshOffset,
             'componentType': 5126,
             'count': nVertices[i],
             'max': [1, 1, 1],
@@ -224,13 +226,14 @@ def compute_header(binVertices, nVertices, bb, transform,
         if textured:
             accessors.append({
                 'bufferView': 2,
-                'byteOffset': int(round(2 / 3 * sum(sizeVce[0:i]))),
+                'byteOffset': int(round(2 / 3 * meshOffset)),
                 'componentType': 5126,
                 'count': sum(nVertices),
                 'max': [1, 1],
                 'min': [0, 0],
                 'type': "VEC2"
             })
+        meshOffset += sizeVce[i]
     if batched:
         accessors.append({
             'bufferView': 3 if textured else 2,
@@ -264,9 +267,10 @@ def compute_header(binVertices, nVertices, bb, transform,
 
     # Nodes
     nodes = []
+    matrix = [float(e) for e in transform]
     for i in range(0, meshNb):
         nodes.append({
-            'matrix': [float(e) for e in transform],
+            'matrix': matrix,
             'mesh': i
         })
 
@@ -286,7 +290,7 @@ def compute_header(binVertices, nVertices, bb, transform,
         },
         'scene': 0,
         'scenes': [{
-            'nodes': [i for i in range(0, len(nodes))]
+            'nodes': list(range(0, len(nodes)))
         }],
         'nodes': nodes,
         'meshes': meshes,
@@ -93,19 +93,17 @@ class TriangleSoup:
         -------
         Binary array of vertice normals
         """
-        normals = []
-        for t in self.triangles[0]:
-            U = t[1] - t[0]
-            V = t[2] - t[0]
-            N = np.cross(U, V)
-            norm = np.linalg.norm(N)
-            if norm == 0:
-                normals.append(np.array([0, 0, 1], dtype=np.float32))
-            else:
-                normals.append(N / norm)
-
-        verticeArray = faceAttributeToArray(normals)
-        return b''.join(verticeArray)
+        triangles = np.array(self.triangles[0], dtype=np.float32).reshape(-1, 3, 3)
+        normals = np.cross(triangles[:, 1] - triangles[:, 0],
+                           triangles[:, 2] - triangles[:, 0])
+        norms = np.linalg.norm(normals, axis=1)
+        degenerate = norms == 0
+        normals[degenerate] = [0, 0, 1]
+        norms[degenerate] = 1
+        normals /= norms[:, np.newaxis]
+
+        # one normal per vertex
+        return np.repeat(normals, 3, axis=0).tobytes()
 
     def getBbox(self):
         """
@@ -116,24 +114,12 @@ class TriangleSoup:
         -------
         Array [[minX, minY, minZ],[maxX, maxY, maxZ]]
         """
-        mins = np.array([np.min(t, 0) for t in self.triangles[0]])
-        maxs = np.array([np.max(t, 0) for t in self.triangles[0]])
-        return [np.min(mins, 0), np.max(maxs, 0)]
-
-
-def faceAttributeToArray(triangles):
-    array = []
-    for face in triangles:
-        array += [face, face, face]
-    return array
+        vertices = np.array(self.triangles[0]).reshape(-1, 3)
+        return [vertices.min(axis=0), vertices.max(axis=0)]
 
 
 def vertexAttributeToArray(triangles):
-    array = []
-    for face in triangles:
-        for vertex in face:
-            array.append(vertex)
-    return array
+    return [vertex for face in triangles for vertex in face]
 
 
 def parse(wkb):
@@ -146,7 +132,7 @@ def parse(wkb):
     hasZ = (geomtype == 1006) or (geomtype == 1015)
     # MultipolygonZ or polyhedralSurface
     pntOffset = 24 if hasZ else 16
-    pntUnpack = 'ddd' if hasZ else 'dd'
+    pntDim = 3 if hasZ else 2
     geomNb = struct.unpack(bo + 'I', wkb[5:9])[0]
     # print(struct.unpack('b', wkb[9:10])[0])
     # print(struct.unpack('I', wkb[10:14])[0])   # 1003 (Polygon)
@@ -162,14 +148,13 @@ def parse(wkb):
         for j in range(0, lineNb):
             pointNb = struct.unpack(bo + 'I', wkb[offset:offset+4])[0]
             offset += 4
-            line = []
-            for k in range(0, pointNb-1):
-                pt = np.array(struct.unpack(bo + pntUnpack, wkb[offset:offset
-                              + pntOffset]), dtype=np.float32)
-                offset += pntOffset
-                line.append(pt)
+            # the points of a ring are contiguous: read them in one go
+            # instead of unpacking them one by one
+            line = np.frombuffer(wkb, dtype=bo + 'f8',
+                                 count=(pointNb - 1) * pntDim, offset=offset)
+            offset += (pointNb - 1) * pntOffset
             offset += pntOffset   # skip redundant point
-            polygon.append(line)
+            polygon.append(list(line.reshape(-1, pntDim).astype(np.float32)))
         multipolygon.append(polygon)
     return multipolygon
 
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import json
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+from py3dtiles import export
+
+
+def read_wkb(filename):
+    with open(os.path.join(os.path.dirname(__file__), filename), 'rb') as f:
+        return f.read()
+
+
+def tile_ids(filename):
+    with open(filename, 'rb') as f:
+        array = f.read()
+    # b3dm header: magic, version, byteLength, then the feature table and
+    # batch table JSON and binary lengths
+    (magic, version, length, ft_json, ft_bin, bt_json, bt_bin) = \
+        struct.unpack('<4s6I', array[0:28])
+    assert magic == b'b3dm'
+    start = 28 + ft_json + ft_bin
+    return json.loads(array[start:start + bt_json].decode('utf-8'))['id']
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        # the export writes tileset.json and tiles/ in the current directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def export_tiles(self):
+        with open('tileset.json') as f:
+            tileset = json.load(f)
+        ids = {}
+        stack = [tileset['root']]
+        while stack:
+            tile = stack.pop()
+            stack.extend(tile['children'])
+            if 'content' in tile:
+                ids[tile['content']['uri']] = tile_ids(tile['content']['uri'])
+        return tileset, ids
+
+    def test_arrays2tileset(self):
+        geoms = [export.wkb2arrays(read_wkb('building.wkb')),
+                 export.wkb2arrays(read_wkb('square.wkb'))]
+
+        # spread copies of the two geometries over a 6000 x 3000 area, in
+        # glTF (Y-up) coordinates
+        positions = []
+        normals = []
+        bboxes = []
+        ids = []
+        for i in range(60):
+            position, normal, bbox = geoms[i % 2]
+            offset = np.array([(i % 10) * 600, i, (i // 10) * 500 + 100],
+                              dtype=np.float32)
+            vertices = np.frombuffer(position, dtype=np.float32)
+            positions.append((vertices.reshape(-1, 3) + offset).tobytes())
+            normals.append(normal)
+            bboxes.append([bbox[0] + offset, bbox[1] + offset])
+            ids.append('f{}'.format(i))
+
+        featuresPerTile = 4
+        export.arrays2tileset(positions, normals, bboxes, export.IDENTITY,
+                              ids, featuresPerTile)
+        tileset, tiles = self.export_tiles()
+
+        # every feature is in exactly one tile, and no tile holds more than
+        # featuresPerTile features
+        exported = [i for t in tiles.values() for i in t]
+        self.assertEqual(sorted(exported), sorted(ids))
+        for t in tiles.values():
+            self.assertLessEqual(len(t), featuresPerTile)
+
+        # the root box is the Z-up extent of all the glTF boxes:
+        # (x, y, z) -> (x, -z, y)
+        corners = np.array(bboxes)
+        mins = [corners[:, 0, 0].min(), -corners[:, 1, 2].max(),
+                corners[:, 0, 1].min()]
+        maxs = [corners[:, 1, 0].max(), -corners[:, 0, 2].min(),
+                corners[:, 1, 1].max()]
+        box = tileset['root']['boundingVolume']['box']
+        for k in range(3):
+            self.assertAlmostEqual(box[k], (mins[k] + maxs[k]) / 2, places=2)
+            self.assertAlmostEqual(box[3 + 4 * k], (maxs[k] - mins[k]) / 2,
+                                   places=2)
+
+    def test_feature_on_extent_max(self):
+        # a feature whose center lies on the extent maximum, at a tile
+        # boundary, still goes into the last tile
+        position, normal, bbox = export.wkb2arrays(read_wkb('square.wkb'))
+        bboxes = [[[0, 0, 0], [10, 1, 10]],
+                  [[4000, 0, 0], [4000, 1, 10]]]
+        export.arrays2tileset([position] * 2, [normal] * 2, bboxes,
+                              export.IDENTITY, ['a', 'b'])
+        tileset, tiles = self.export_tiles()
+
+        exported = [i for t in tiles.values() for i in t]
+        self.assertEqual(sorted(exported), ['a', 'b'])
+
+    def test_empty_geometry(self):
+        empty = b'\x01' + struct.pack('<I', 1015) + struct.pack('<I', 0)
+        wkbs = [read_wkb('building.wkb'), empty, read_wkb('square.wkb')]
+        export.wkbs2tileset(wkbs, ['a', 'b', 'c'], export.IDENTITY, jobs=1)
+        tileset, tiles = self.export_tiles()
+
+        exported = [i for t in tiles.values() for i in t]
+        self.assertEqual(sorted(exported), ['a', 'c'])
+
+    def test_features_per_tile(self):
+        position, normal, bbox = export.wkb2arrays(read_wkb('square.wkb'))
+        for featuresPerTile in (0, -1):
+            with self.assertRaises(ValueError):
+                export.arrays2tileset([position], [normal], [bbox],
+                                      export.IDENTITY,
+                                      featuresPerTile=featuresPerTile)